@@ -2,80 +2,345 @@ import os
 import flask
 from flask import Flask, request, render_template, redirect, url_for, send_from_directory, flash
 import json
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+import shared_state
+try:
+    import fcntl
+except ImportError:  # Windows: eviction is not serialized across processes
+    fcntl = None
 
 
 try:
 
-    from model_wt_audio_2 import process_single_request 
+    from model_wt_audio_2 import (
+        process_single_request, rerender_playlist, get_parse_metrics, normalize_request_key,
+        AUDIO_PROFILES, AUDIO_PROFILE
+    )
 except ImportError as e:
     print(f"ERROR: Could not import 'process_single_request' from model_wt_audio.py: {e}")
     print("Make sure model_wt_audio.py exists and the function is defined correctly.")
     exit()
 
 
+shared_state.init_db()
+
 app = Flask(__name__)
-app.secret_key = os.urandom(24) 
+# Shared through the state DB so flash messages survive across web worker processes
+app.secret_key = shared_state.get_or_create_secret_key()
 PLAYLIST_BASE_DIR = "generated_playlists"
 
+# 'inline' runs /generate jobs on threads inside the web process (dev server).
+# 'queue' leaves them in the shared job table for the worker.py generation pool.
+GENERATION_MODE = os.getenv("GENERATION_MODE", "inline")
+
 os.makedirs(PLAYLIST_BASE_DIR, exist_ok=True)
 
+# Retention policy: least-recently-played playlists are evicted once either limit is exceeded.
+PLAYLIST_STORAGE_QUOTA_MB = int(os.getenv("PLAYLIST_STORAGE_QUOTA_MB", "500"))
+PLAYLIST_MAX_COUNT = int(os.getenv("PLAYLIST_MAX_COUNT", "50"))
+# Lock file in PLAYLIST_BASE_DIR that serializes enforce_storage_quota() callers
+EVICTION_LOCK_FILE = ".eviction.lock"
+
 
 #NOTE
-SESSION_HISTORY = []
-# Store {'name': 'folder_name_relative_to_base', 'title': 'Playlist Title'}
-GENERATED_FOLDERS_INFO = []
+# Session history, the playlist catalog and play times live in shared_state so
+# every web and generation worker process sees the same data.
+
+# Bounds for the /events progress feed.
+# Each open stream holds one server thread (gthread under gunicorn), so streams
+# may use at most half of WEB_THREADS and the rest stay free for normal requests.
+WEB_THREADS = int(os.getenv("WEB_THREADS", "16"))
+PROGRESS_QUEUE_SIZE = 100
+PROGRESS_MAX_SUBSCRIBERS = max(1, WEB_THREADS // 2)
+PROGRESS_KEEPALIVE_SECONDS = 15
+PROGRESS_POLL_SECONDS = 0.5
+# A per-job /events stream closes after one of these
+TERMINAL_PROGRESS_EVENTS = ('playlist_ready', 'finished', 'rerender_finished')
+
+
+class ProgressBroker:
+    """
+    In-process pub/sub for generation progress events, one channel per job id.
+    Each subscriber gets
+    a bounded queue; when a slow client's queue is full its oldest event is dropped
+    so publishing never blocks the generation pipeline.
+    """
+
+    def __init__(self, queue_size, max_subscribers):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._count = 0
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+
+    def subscribe(self, channel):
+        """Returns a new subscriber queue, or None if the subscriber limit is reached."""
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscriber = queue.Queue(maxsize=self.queue_size)
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+            self._count += 1
+            return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, set())
+            if subscriber in subscribers:
+                subscribers.discard(subscriber)
+                self._count -= 1
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+    def publish(self, channel, item):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+PROGRESS_BROKER = ProgressBroker(PROGRESS_QUEUE_SIZE, PROGRESS_MAX_SUBSCRIBERS)
+_event_tailer_lock = threading.Lock()
+_event_tailer_started = False
+
+
+def tail_progress_events():
+    """Forwards progress events written to the shared store by any process into this process's broker."""
+    last_id = shared_state.get_last_event_id()
+    last_prune = time.time()
+    while True:
+        try:
+            for last_id, event, data in shared_state.get_events_after(last_id):
+                PROGRESS_BROKER.publish(data.get('job_id'), (last_id, event, data))
+            if time.time() - last_prune > 60:
+                shared_state.reap_stale_jobs()
+                shared_state.prune_events()
+                last_prune = time.time()
+        except Exception as e:
+            print(f"Error reading progress events: {e}")
+        time.sleep(PROGRESS_POLL_SECONDS)
+
+
+def ensure_event_tailer():
+    """Starts this process's event tailer thread on first use."""
+    global _event_tailer_started
+    with _event_tailer_lock:
+        if not _event_tailer_started:
+            threading.Thread(target=tail_progress_events, daemon=True).start()
+            _event_tailer_started = True
+
+
+def get_folder_size(folder_path):
+    """Returns the total size in bytes of all files under folder_path."""
+    total = 0
+    for root, _, files in os.walk(folder_path):
+        for filename in files:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+
+def mark_played(folder_name):
+    """Records that a playlist was just opened or streamed."""
+    shared_state.mark_played(folder_name)
+
+
+def get_storage_usage():
+    """
+    Scans PLAYLIST_BASE_DIR and returns disk usage per playlist, ordered from
+    least to most recently played. Playlists never played fall back to folder mtime.
+    A playlist is 'evictable' only once it is complete (has a summary file or a
+    catalog entry) and no queued or running job is writing to it.
+    """
+    base_dir = os.path.abspath(PLAYLIST_BASE_DIR)
+    last_played = shared_state.get_last_played()
+    catalog = shared_state.get_playlist_names()
+    busy = shared_state.get_busy_folders()
+    playlists = []
+    for folder_name in os.listdir(base_dir):
+        folder_path = os.path.join(base_dir, folder_name)
+        if not os.path.isdir(folder_path):
+            continue
+        playlists.append({
+            'name': folder_name,
+            'size_bytes': get_folder_size(folder_path),
+            'last_played': last_played.get(folder_name, os.path.getmtime(folder_path)),
+            'evictable': folder_name not in busy and (
+                folder_name in catalog or os.path.exists(os.path.join(folder_path, "playlist_summary.json"))
+            ),
+        })
+    playlists.sort(key=lambda p: p['last_played'])
+    return {
+        'total_bytes': sum(p['size_bytes'] for p in playlists),
+        'quota_bytes': PLAYLIST_STORAGE_QUOTA_MB * 1024 * 1024,
+        'max_count': PLAYLIST_MAX_COUNT,
+        'playlists': playlists,
+    }
+
+
+def enforce_storage_quota(protect=None):
+    """
+    Evicts least-recently-played playlists from disk and from the playlist catalog
+    until usage is within PLAYLIST_STORAGE_QUOTA_MB and PLAYLIST_MAX_COUNT.
+    Only 'evictable' playlists (see get_storage_usage) are removed, and the
+    folder named by 'protect' (e.g. the one just generated) is never evicted.
+    Concurrent callers (threads or worker processes) are serialized with a lock
+    file so each one works from a fresh usage snapshot.
+    Returns the list of evicted folder names.
+    """
+    evicted = []
+    with open(os.path.join(PLAYLIST_BASE_DIR, EVICTION_LOCK_FILE), "w") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        usage = get_storage_usage()
+        total_bytes = usage['total_bytes']
+        remaining = len(usage['playlists'])
+
+        for playlist in usage['playlists']:
+            if total_bytes <= usage['quota_bytes'] and remaining <= PLAYLIST_MAX_COUNT:
+                break
+            if playlist['name'] == protect or not playlist['evictable']:
+                continue
+            folder_path = os.path.join(os.path.abspath(PLAYLIST_BASE_DIR), playlist['name'])
+            try:
+                shutil.rmtree(folder_path)
+            except FileNotFoundError:
+                # Already removed by someone else; it no longer counts against the quota
+                print(f"Playlist folder {folder_path} was already evicted.")
+            except OSError as e:
+                print(f"Error evicting playlist folder {folder_path}: {e}")
+                continue
+            else:
+                evicted.append(playlist['name'])
+                print(f"Evicted playlist '{playlist['name']}' ({playlist['size_bytes']} bytes) to stay within storage quota.")
+            total_bytes -= playlist['size_bytes']
+            remaining -= 1
+            shared_state.forget_playlist(playlist['name'])
+
+    return evicted
+
+
+
+def run_generation(input_text, audio_profile, progress_callback=None):
+    """
+    Runs the generation pipeline for one prompt and records the resulting playlist.
+    Returns (folder_name or None, list of (message, category) pairs describing the outcome).
+    """
+    session_history = shared_state.get_session_history()
+    print(f"Current session history before processing: {session_history}")
+    folder_name = None
+    messages = []
+
+    try:
+       
+        result = process_single_request(input_text, session_history, audio_profile, progress_callback)
+        # ---------------------------------------------
+
+        if result and result.get("folder_path") and result.get("folder_name"):
+             folder_name = result["folder_name"]
+             folder_path = result["folder_path"] 
+             new_topics = result.get("generated_topics", [])
+
+             # Update app-level session history (once, even if other requests joined this run)
+             if not result.get("shared"):
+                  shared_state.extend_session_history(new_topics)
+                  print(f"Session history updated with: {new_topics}")
+
+             # Add to the display list, avoiding duplicates
+             if shared_state.add_playlist(folder_name, f"Playlist: {folder_name}"):
+                  messages.append((f'Successfully generated playlist: {folder_name}', 'success'))
+             else:
+                  messages.append((f'Playlist folder already generated: {folder_name}', 'info'))
+
+             mark_played(folder_name)
+             evicted = enforce_storage_quota(protect=folder_name)
+             if evicted:
+                  messages.append((f'Removed {len(evicted)} least recently played playlist(s) to stay within storage quota.', 'info'))
+
+        elif result is None:
+             # Function indicated failure explicitly
+             messages.append(('Playlist generation failed during processing.', 'error'))
+        else:
+             raise ValueError(f"Processing function returned unexpected data: {result}")
+
+
+    except Exception as e:
+        print(f"Error during processing call: {e}") 
+        messages.append((f'An error occurred during processing: {e}', 'error'))
 
+    return folder_name, messages
+
+
+def keep_job_alive(job_id, stop):
+    """Refreshes a running job's heartbeat until 'stop' is set."""
+    while not stop.wait(shared_state.JOB_HEARTBEAT_SECONDS):
+        try:
+            shared_state.heartbeat_job(job_id)
+        except Exception as e:
+            print(f"Error updating heartbeat for job {job_id}: {e}")
+
+
+def run_generation_job(job_id, input_text, audio_profile):
+    """
+    Runs one queued /generate job (on an inline thread or in a worker.py process)
+    and writes its progress to the shared store for the /events feed.
+    """
+
+    def publish(event, data):
+        if event == "playlist_folder":
+            # Internal: protects the in-progress folder from storage-quota eviction
+            shared_state.add_job_folder(job_id, data["folder_name"])
+            return
+        shared_state.add_event(job_id, event, dict(data, job_id=job_id))
+
+    folder_name = None
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=keep_job_alive, args=(job_id, stop_heartbeat), daemon=True).start()
+    try:
+        folder_name, messages = run_generation(input_text, audio_profile, publish)
+        if folder_name:
+            publish("playlist_ready", {"folder_name": folder_name, "messages": messages})
+        else:
+            publish("finished", {"messages": messages})
+    finally:
+        stop_heartbeat.set()
+        shared_state.finish_job(job_id, "done" if folder_name else "failed")
 
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    global SESSION_HISTORY 
-
     if request.method == 'POST':
         input_text = request.form.get('text_input', '').strip()
+        audio_profile = request.form.get('audio_profile', AUDIO_PROFILE)
 
         if not input_text:
             flash('Please enter some text.', 'error')
             return redirect(url_for('index'))
 
         print(f"Received POST request with prompt: '{input_text}'")
-        print(f"Current session history before processing: {SESSION_HISTORY}")
-
-        try:
-           
-            result = process_single_request(input_text, SESSION_HISTORY)
-            # ---------------------------------------------
-
-            if result and result.get("folder_path") and result.get("folder_name"):
-                 folder_name = result["folder_name"]
-                 folder_path = result["folder_path"] 
-                 new_topics = result.get("generated_topics", [])
-
-                 # Update app-level session history
-                 SESSION_HISTORY.extend(new_topics)
-                 print(f"Session history updated: {SESSION_HISTORY}")
-
-                 # Prepare info for display list
-                 folder_info = {'name': folder_name, 'title': f"Playlist: {folder_name}"}
-
-                 # Avoid adding duplicates 
-                 if not any(f['name'] == folder_name for f in GENERATED_FOLDERS_INFO):
-                      GENERATED_FOLDERS_INFO.insert(0, folder_info) # Add newest first
-                      flash(f'Successfully generated playlist: {folder_name}', 'success')
-                 else:
-                      flash(f'Playlist folder already generated: {folder_name}', 'info')
-
-            elif result is None:
-                 # Function indicated failure explicitly
-                 flash('Playlist generation failed during processing.', 'error')
-            else:
-                 raise ValueError(f"Processing function returned unexpected data: {result}")
-
-
-        except Exception as e:
-            print(f"Error during processing call: {e}") 
-            flash(f'An error occurred during processing: {e}', 'error')
+        if GENERATION_MODE == 'queue':
+            start_generation_job(input_text, audio_profile)
+            flash('Playlist generation queued. Refresh in a few minutes to see it.', 'info')
+            return redirect(url_for('index'))
 
+        _, messages = run_generation(input_text, audio_profile)
+        for message, category in messages:
+            flash(message, category)
 
         # Redirect back to the GET request AFTER processing is complete
         return redirect(url_for('index'))
@@ -83,7 +348,222 @@ def index():
     # --- GET Request ---
     # Render the template with the current list of generated folders info
     # Pass a copy to avoid potential modification issues if needed
-    return render_template('index.html', folders=list(GENERATED_FOLDERS_INFO))
+    usage = get_storage_usage()
+    return render_template(
+        'index.html',
+        folders=shared_state.list_playlists(),
+        audio_profiles=list(AUDIO_PROFILES),
+        default_audio_profile=AUDIO_PROFILE,
+        storage_used_mb=round(usage['total_bytes'] / (1024 * 1024), 1),
+        storage_quota_mb=PLAYLIST_STORAGE_QUOTA_MB
+    )
+
+
+def start_generation_job(input_text, audio_profile):
+    """
+    Queues a job for the prompt, or attaches to an equivalent job already queued
+    or running in any process. In inline mode a new job is started on a thread here.
+    Returns the job id whose progress the caller should follow.
+    """
+    if audio_profile not in AUDIO_PROFILES:
+        audio_profile = AUDIO_PROFILE
+    request_key = json.dumps([normalize_request_key(input_text), audio_profile])
+    job_id, created = shared_state.enqueue_job(uuid.uuid4().hex, request_key, input_text, audio_profile)
+    if not created:
+        print(f"Attached to in-flight job {job_id} for prompt: '{input_text}'")
+        return job_id
+
+    shared_state.add_event(job_id, "started", {"job_id": job_id, "prompt": input_text})
+    if GENERATION_MODE != 'queue':
+        shared_state.start_job(job_id)
+        threading.Thread(target=run_generation_job, args=(job_id, input_text, audio_profile), daemon=True).start()
+    return job_id
+
+
+@app.route('/generate', methods=['POST'])
+def generate():
+    """Starts generation in the background and returns a job id; progress is pushed on /events."""
+    input_text = request.form.get('text_input', '').strip()
+    audio_profile = request.form.get('audio_profile', AUDIO_PROFILE)
+    if not input_text:
+        return flask.jsonify({'error': 'Please enter some text.'}), 400
+
+    print(f"Received /generate request with prompt: '{input_text}'")
+    return flask.jsonify({'job_id': start_generation_job(input_text, audio_profile)}), 202
+
+
+@app.route('/events')
+def events():
+    """
+    Server-Sent Events stream for ?job_id=...: replays and then follows that
+    job's progress, closing after its terminal event. Only per-job streams are
+    offered, so every open stream belongs to a job someone is waiting on.
+    """
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return flask.jsonify({'error': "Missing 'job_id'."}), 400
+    ensure_event_tailer()
+    try:
+        last_sent = int(request.headers.get('Last-Event-ID') or 0)
+    except ValueError:
+        last_sent = 0
+    # Subscribe before replaying so nothing recorded in between is missed
+    subscriber = PROGRESS_BROKER.subscribe(job_id)
+    if subscriber is None:
+        flask.abort(503)
+
+    def format_event(event_id, event, data):
+        return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def stream():
+        nonlocal last_sent
+        try:
+            for event_id, event, data in shared_state.get_job_events(job_id):
+                if event_id <= last_sent:
+                    continue
+                yield format_event(event_id, event, data)
+                last_sent = event_id
+                if event in TERMINAL_PROGRESS_EVENTS:
+                    return
+            while True:
+                try:
+                    event_id, event, data = subscriber.get(timeout=PROGRESS_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event_id <= last_sent:
+                    continue
+                yield format_event(event_id, event, data)
+                last_sent = event_id
+                if event in TERMINAL_PROGRESS_EVENTS:
+                    return
+        finally:
+            PROGRESS_BROKER.unsubscribe(job_id, subscriber)
+
+    return flask.Response(
+        flask.stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def run_rerender_job(job_id, folder_names, voice_ids, languages, audio_profile):
+    """
+    Runs one queued /rerender job (on an inline thread or in a worker.py process):
+    re-renders each playlist and writes progress to the shared store.
+    """
+
+    def publish(event, data):
+        shared_state.add_event(job_id, event, dict(data, job_id=job_id))
+
+    results = {}
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=keep_job_alive, args=(job_id, stop_heartbeat), daemon=True).start()
+    try:
+        for folder_name in folder_names:
+            folder_path = os.path.join(PLAYLIST_BASE_DIR, folder_name)
+            try:
+                variants = rerender_playlist(folder_path, voice_ids, languages, audio_profile, publish)
+            except Exception as e:
+                print(f"Error re-rendering playlist {folder_name}: {e}")
+                variants = None
+            results[folder_name] = len(variants) if variants is not None else None
+            if variants:
+                enforce_storage_quota(protect=folder_name)
+        publish("rerender_finished", {"variants_per_playlist": results})
+    finally:
+        stop_heartbeat.set()
+        shared_state.finish_job(job_id, "done" if any(results.values()) else "failed")
+
+
+def run_job(job):
+    """Runs a job claimed from the shared table (used by worker.py)."""
+    if job.get('kind') == 'rerender':
+        payload = job['payload']
+        run_rerender_job(job['job_id'], payload['playlists'], payload['voice_ids'], payload['languages'], job['audio_profile'])
+    else:
+        run_generation_job(job['job_id'], job['prompt'], job['audio_profile'])
+
+
+def start_rerender_job(folder_names, voice_ids, languages, audio_profile):
+    """
+    Queues a re-render job, or attaches to an identical one already queued or
+    running. In inline mode a new job is started on a thread here.
+    Returns the job id whose progress the caller should follow.
+    """
+    if audio_profile not in AUDIO_PROFILES:
+        audio_profile = AUDIO_PROFILE
+    payload = {'playlists': folder_names, 'voice_ids': voice_ids, 'languages': languages}
+    request_key = json.dumps(['rerender', sorted(folder_names), sorted(voice_ids), sorted(languages or []), audio_profile])
+    job_id, created = shared_state.enqueue_job(
+        uuid.uuid4().hex, request_key, f"rerender: {', '.join(folder_names)}", audio_profile,
+        kind='rerender', payload=payload
+    )
+    if not created:
+        print(f"Attached to in-flight re-render job {job_id}")
+        return job_id
+
+    for folder_name in folder_names:
+        shared_state.add_job_folder(job_id, folder_name)
+    shared_state.add_event(job_id, "started", {"job_id": job_id, "playlists": folder_names})
+    if GENERATION_MODE != 'queue':
+        shared_state.start_job(job_id)
+        threading.Thread(
+            target=run_rerender_job, args=(job_id, folder_names, voice_ids, languages, audio_profile), daemon=True
+        ).start()
+    return job_id
+
+
+@app.route('/rerender', methods=['POST'])
+def rerender():
+    """
+    Re-renders existing playlists from their saved scripts into more voices and/or
+    languages without re-running search or script generation.
+    JSON body: {"playlists": [...], "voice_ids": [...], "languages": [...], "audio_profile": "mobile"}
+    The job is queued for the worker.py pool (or run inline in GENERATION_MODE=inline).
+    Returns a job id; progress ("rerender", "rerender_finished") is pushed on /events?job_id=...
+    """
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return flask.jsonify({'error': 'Request body must be a JSON object.'}), 400
+    folder_names = body.get('playlists') or []
+    voice_ids = body.get('voice_ids') or []
+    languages = body.get('languages') or []
+    audio_profile = body.get('audio_profile', AUDIO_PROFILE)
+
+    if not all(isinstance(field, list) for field in (folder_names, voice_ids, languages)):
+        return flask.jsonify({'error': "'playlists', 'voice_ids' and 'languages' must be lists."}), 400
+    if not isinstance(audio_profile, str):
+        return flask.jsonify({'error': "'audio_profile' must be a string."}), 400
+    if not folder_names or not (voice_ids or languages):
+        return flask.jsonify({'error': "Provide 'playlists' and at least one of 'voice_ids' or 'languages'."}), 400
+    if not all(isinstance(v, str) and v for v in folder_names + voice_ids + languages):
+        return flask.jsonify({'error': 'Playlists, voice ids and languages must be non-empty strings.'}), 400
+    # Voice ids are placed in the ElevenLabs URL path and in variant folder names
+    invalid_voices = [v for v in voice_ids if not re.fullmatch(r"[A-Za-z0-9]+", v)]
+    if invalid_voices:
+        return flask.jsonify({'error': f'Invalid voice ids: {invalid_voices}'}), 400
+
+    base_dir = os.path.abspath(PLAYLIST_BASE_DIR)
+    missing = [name for name in folder_names
+               if os.path.basename(name) != name or not os.path.isdir(os.path.join(base_dir, name))]
+    if missing:
+        return flask.jsonify({'error': f'Unknown playlists: {missing}'}), 404
+
+    print(f"Received /rerender request for {folder_names}")
+    return flask.jsonify({'job_id': start_rerender_job(folder_names, voice_ids, languages or None, audio_profile)}), 202
+
+
+@app.route('/storage')
+def storage_usage():
+    """Returns disk-usage accounting for generated playlists as JSON."""
+    return flask.jsonify(get_storage_usage())
+
+
+@app.route('/metrics/parsing')
+def parsing_metrics():
+    """Returns per-call structured-output parse statistics as JSON."""
+    return flask.jsonify(get_parse_metrics())
 
 
 @app.route('/view/<folder_name>')
@@ -95,7 +575,11 @@ def view_folder(folder_name):
         flash(f"Folder '{folder_name}' not found or is inaccessible.", "error")
         return redirect(url_for('index'))
 
+    mark_played(folder_name)
+
     audio_files = []
+    # [{'label': 'es / voice_id (mobile)', 'files': ['variants/.../segment_1_x.mp3', ...]}]
+    variants = []
     summary_data = None
     error_message = None
 
@@ -111,6 +595,12 @@ def view_folder(folder_name):
                            if 'audio_file' in segment:
                                 # Get only the filename part from the relative path
                                 audio_files.append(os.path.basename(segment['audio_file']))
+                 for variant in (summary_data or {}).get('variants', []):
+                      variants.append({
+                           'label': f"{variant.get('language') or 'original'} / {variant['voice_id']} ({variant['audio_profile']})",
+                           # Paths relative to this folder, for the serve_audio route
+                           'files': [os.path.relpath(seg['audio_file'], folder_name).replace(os.sep, '/') for seg in variant['segments']],
+                      })
         else:
              # Fallback: list directory if summary is missing
              for filename in os.listdir(folder_path):
@@ -129,6 +619,7 @@ def view_folder(folder_name):
         folder_name=folder_name,
         playlist_title=playlist_title,
         audio_files=audio_files, 
+        variants=variants,
         error=error_message
     )
 
@@ -157,6 +648,8 @@ def serve_audio(filepath):
          print(f"Directory not found: {directory}")
          flask.abort(404)
 
+    mark_played(os.path.relpath(abs_filepath, base_dir).split(os.sep)[0])
+
     try:
 
         return send_from_directory(directory, filename, as_attachment=False)
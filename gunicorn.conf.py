@@ -0,0 +1,15 @@
+# Production web serving: `gunicorn -c gunicorn.conf.py app:app`, alongside `python worker.py`.
+import os
+import multiprocessing
+
+# Web workers only enqueue jobs; generation runs in the worker.py pool
+os.environ.setdefault("GENERATION_MODE", "queue")
+# app.py reads WEB_THREADS too, to keep /events streams below the thread count
+os.environ.setdefault("WEB_THREADS", "16")
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# Threaded workers so long-lived /events streams don't tie up a whole process
+worker_class = "gthread"
+threads = int(os.environ["WEB_THREADS"])
+timeout = 120
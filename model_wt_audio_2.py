@@ -7,6 +7,16 @@ import math
 import time 
 import requests 
 import re 
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import shared_state
+try:
+    import fcntl
+except ImportError:  # Windows: summary writes are still atomic, just not cross-process locked
+    fcntl = None
 
 # --- Configuration --- 
 load_dotenv()
@@ -26,19 +36,226 @@ gemini_model = genai.GenerativeModel('gemini-1.5-flash')
 # Configure Tavily Search 
 tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
 
+# Parse metrics (and app state) live in the shared store so every worker process reports into it
+shared_state.init_db()
+
 
 SEGMENT_DURATION_MINUTES = 5
 WORDS_PER_MINUTE = 160
 TARGET_WORD_COUNT = SEGMENT_DURATION_MINUTES * WORDS_PER_MINUTE
 SEARCH_RESULT_COUNT = 3
+# Approximate prompt-token budget for the search context passed to script generation (~4 chars per token).
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+CONTEXT_DUPLICATE_SIMILARITY = 0.8
+CONTEXT_MIN_SENTENCE_WORDS = 4
+CONTEXT_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is",
+    "it", "its", "of", "on", "or", "that", "the", "this", "to", "was", "were", "which", "with",
+}
 
 ELEVENLABS_VOICE_ID = "EXAVITQu4vr4xnSDxMaL"
-ELEVENLABS_API_URL = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
+ELEVENLABS_TTS_URL = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+ELEVENLABS_API_URL = ELEVENLABS_TTS_URL.format(voice_id=ELEVENLABS_VOICE_ID)
+# Used instead of the default TTS model when rendering translated scripts
+ELEVENLABS_MULTILINGUAL_MODEL_ID = "eleven_multilingual_v2"
+# Parallel translation / TTS calls per re-render batch
+RERENDER_MAX_WORKERS = int(os.getenv("RERENDER_MAX_WORKERS", "4"))
+RERENDER_EXECUTOR = ThreadPoolExecutor(max_workers=RERENDER_MAX_WORKERS, thread_name_prefix="rerender")
 ELEVENLABS_HEADERS = {
     "xi-api-key": ELEVENLABS_API_KEY,
     "Content-Type": "application/json"
 }
 
+# Output profiles requested from ElevenLabs via the `output_format` query parameter.
+# 'mobile' keeps segments small for storage and egress; 'standard' matches the API default.
+AUDIO_PROFILES = {
+    "mobile": {"output_format": "mp3_22050_32", "extension": "mp3"},
+    "standard": {"output_format": "mp3_44100_128", "extension": "mp3"},
+    "high": {"output_format": "mp3_44100_192", "extension": "mp3"},
+}
+AUDIO_PROFILE = os.getenv("AUDIO_PROFILE", "standard")
+if AUDIO_PROFILE not in AUDIO_PROFILES:
+    print(f"Warning: Unknown AUDIO_PROFILE '{AUDIO_PROFILE}'. Falling back to 'standard'.")
+    AUDIO_PROFILE = "standard"
+
+
+GEMINI_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+# Expected shapes of structured Gemini responses.
+# A dict maps required keys to accepted types; a one-element list means "list of that type".
+ANALYSIS_SCHEMA = {"total_time_minutes": (int, float), "requested_topics": list, "requires_suggestion": bool}
+TOPIC_LIST_SCHEMA = [str]
+
+# Outcomes counted per call in shared_state's parse_metrics table
+PARSE_METRIC_OUTCOMES = ("calls", "fast_path", "extracted", "repaired", "failed")
+
+
+def record_parse_metric(call_name, outcome):
+    """Increments a shared parse counter. Metrics errors never abort generation."""
+    try:
+        shared_state.increment_parse_metric(call_name, outcome)
+    except Exception as e:
+        print(f"Error recording parse metric {call_name}/{outcome}: {e}")
+
+
+def get_response_text(response):
+    """
+    Returns the text of a Gemini response, falling back to the first part
+    when response.text is unavailable. Raises ValueError if blocked or empty.
+    """
+    try:
+        return response.text.strip()
+    except ValueError:
+        if response.parts:
+            return response.parts[0].text.strip()
+        raise ValueError("Gemini response blocked or empty.")
+
+
+def _json_candidates(text):
+    """Yields (value, used_fast_path) for every JSON value found in model output, best guess first."""
+    try:
+        yield json.loads(text), True
+    except json.JSONDecodeError:
+        pass
+
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL | re.IGNORECASE)
+    if fenced:
+        try:
+            yield json.loads(fenced.group(1).strip()), False
+        except json.JSONDecodeError:
+            pass
+
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"[\[{]", text):
+        try:
+            value, _ = decoder.raw_decode(text, match.start())
+            yield value, False
+        except json.JSONDecodeError:
+            continue
+
+
+def extract_json(text, schema=None, expected_length=None):
+    """
+    Parses JSON from model output. Tries the raw text first (fast path), then
+    the contents of a ```json fence, then each JSON object/array embedded in
+    surrounding prose. With a schema, returns the first candidate that passes
+    validate_schema(), falling back to the first one that parsed.
+    Returns (parsed_value, used_fast_path).
+    Raises json.JSONDecodeError if nothing parses.
+    """
+    first = None
+    for value, used_fast_path in _json_candidates(text):
+        if schema is None or validate_schema(value, schema, expected_length) is None:
+            return value, used_fast_path
+        if first is None:
+            first = (value, used_fast_path)
+    if first is not None:
+        return first
+    # Re-raise the error for the raw text
+    return json.loads(text), True
+
+
+def validate_schema(data, schema, expected_length=None):
+    """
+    Checks 'data' against a schema (see ANALYSIS_SCHEMA / TOPIC_LIST_SCHEMA).
+    Returns an error message string, or None if the data is valid.
+    """
+    if isinstance(schema, dict):
+        if not isinstance(data, dict):
+            return f"expected a JSON object, got {type(data).__name__}"
+        for key, expected_type in schema.items():
+            if key not in data:
+                return f"missing key '{key}'"
+            # bool is a subclass of int; don't let true/false pass as a number
+            if isinstance(data[key], bool) and expected_type is not bool:
+                return f"key '{key}' has type bool"
+            if not isinstance(data[key], expected_type):
+                return f"key '{key}' has type {type(data[key]).__name__}"
+        return None
+
+    if isinstance(schema, list):
+        if not isinstance(data, list):
+            return f"expected a JSON list, got {type(data).__name__}"
+        if schema and not all(isinstance(item, schema[0]) for item in data):
+            return f"list items must be {schema[0].__name__}"
+        if expected_length is not None and len(data) != expected_length:
+            return f"expected exactly {expected_length} items, got {len(data)}"
+        return None
+
+    return None
+
+
+def _parse_and_validate(text, schema, expected_length):
+    """Returns (data, used_fast_path, error_message)."""
+    try:
+        data, used_fast_path = extract_json(text, schema, expected_length)
+    except json.JSONDecodeError as e:
+        return None, False, f"invalid JSON ({e})"
+    error = validate_schema(data, schema, expected_length)
+    return data, used_fast_path, error
+
+
+def generate_structured_response(prompt, schema, call_name, expected_length=None):
+    """
+    Sends 'prompt' to Gemini and returns the parsed, schema-valid JSON value.
+    If the first answer can't be parsed or validated, asks Gemini once to repair it.
+    Records exactly one outcome per call with record_parse_metric(); a call that
+    raises (API error, blocked or empty response) counts as "failed".
+    Raises ValueError if the response is blocked or still invalid after repair.
+    """
+    record_parse_metric(call_name, "calls")
+
+    try:
+        response = gemini_model.generate_content(prompt, safety_settings=GEMINI_SAFETY_SETTINGS)
+        text = get_response_text(response)
+    except Exception:
+        record_parse_metric(call_name, "failed")
+        raise
+    data, used_fast_path, error = _parse_and_validate(text, schema, expected_length)
+    if error is None:
+        record_parse_metric(call_name, "fast_path" if used_fast_path else "extracted")
+        return data
+
+    print(f"Warning: {call_name} response failed validation ({error}). Requesting repair...")
+    repair_prompt = f"""
+    Your previous response could not be used: {error}.
+
+    Original instructions:
+    {prompt}
+
+    Your previous response:
+    {text}
+
+    Return ONLY the corrected JSON, with no code fences or commentary.
+    """
+    try:
+        repair_response = gemini_model.generate_content(repair_prompt, safety_settings=GEMINI_SAFETY_SETTINGS)
+        repaired_text = get_response_text(repair_response)
+    except Exception:
+        record_parse_metric(call_name, "failed")
+        raise
+    data, _, error = _parse_and_validate(repaired_text, schema, expected_length)
+    if error is None:
+        record_parse_metric(call_name, "repaired")
+        return data
+
+    record_parse_metric(call_name, "failed")
+    print("Raw Response Text:", repaired_text)
+    raise ValueError(f"{call_name} returned invalid structured output after repair: {error}")
+
+
+def get_parse_metrics():
+    """Returns per-call structured-output parse statistics summed across all worker processes."""
+    metrics = {}
+    for call_name, outcome, count in shared_state.get_parse_metrics():
+        metrics.setdefault(call_name, dict.fromkeys(PARSE_METRIC_OUTCOMES, 0))[outcome] = count
+    return metrics
+
 
 def analyze_user_prompt(user_prompt):
     """
@@ -88,23 +305,7 @@ def analyze_user_prompt(user_prompt):
     Provide ONLY the JSON object as the response.
     """
     try:
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ]
-        response = gemini_model.generate_content(prompt, safety_settings=safety_settings)
-        try:
-             json_text = response.text.strip().replace('```json', '').replace('```', '').strip()
-             analysis = json.loads(json_text)
-        except ValueError:
-            print("Warning: Gemini response did not contain valid text content. Checking parts...")
-            if response.parts:
-                 json_text = response.parts[0].text.strip().replace('```json', '').replace('```', '').strip()
-                 analysis = json.loads(json_text)
-            else:
-                raise ValueError("Gemini response blocked or empty.")
+        analysis = generate_structured_response(prompt, ANALYSIS_SCHEMA, "analyze_user_prompt")
 
         # --- Refined Post-processing and Defaulting ---
         if "error" in analysis:
@@ -153,13 +354,8 @@ def analyze_user_prompt(user_prompt):
         print("Prompt Analysis Complete:", analysis)
         return analysis
 
-    except json.JSONDecodeError as e:
-        print(f"Error: Gemini did not return valid JSON for prompt analysis. JSONDecodeError: {e}")
-        print("Raw Response Text:", json_text if 'json_text' in locals() else 'N/A')
-        return {"error": f"JSON Decode Error during analysis: {e}"}
     except ValueError as e:
-         print(f"Error: Gemini response issue (likely blocked or empty). Error: {e}")
-         print("Full Response object:", response)
+         print(f"Error: Gemini response issue (blocked, empty or invalid JSON). Error: {e}")
          return {"error": f"Gemini response issue: {e}"}
     except Exception as e:
         print(f"Error during prompt analysis: {e}")
@@ -192,21 +388,8 @@ def suggest_single_topic(user_prompt_for_context, topic_history):
     Respond with ONLY the suggested topic as a plain string, without quotes or labels.
     """
     try:
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ]
-        response = gemini_model.generate_content(prompt, safety_settings=safety_settings)
-        suggested_topic = ""
-        try:
-            suggested_topic = response.text.strip().strip('"')
-        except ValueError:
-            if response.parts:
-                suggested_topic = response.parts[0].text.strip().strip('"')
-            else:
-                 raise ValueError("Gemini response blocked or empty for single topic suggestion.")
+        response = gemini_model.generate_content(prompt, safety_settings=GEMINI_SAFETY_SETTINGS)
+        suggested_topic = get_response_text(response).strip('"')
 
         if not suggested_topic:
             print("Warning: Gemini did not suggest a topic. Defaulting.")
@@ -238,33 +421,11 @@ def suggest_multiple_topics(existing_topics, num_suggestions):
     Provide ONLY a JSON list of strings as the response. Example: ["Topic A", "Topic B"]
     """
     try:
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ]
-        response = gemini_model.generate_content(prompt, safety_settings=safety_settings)
-        json_text = ""
-        try:
-             json_text = response.text.strip().replace('```json', '').replace('```', '').strip()
-             suggestions = json.loads(json_text)
-        except ValueError:
-            if response.parts:
-                 json_text = response.parts[0].text.strip().replace('```json', '').replace('```', '').strip()
-                 suggestions = json.loads(json_text)
-            else:
-                raise ValueError("Gemini response blocked or empty for multiple topic suggestion.")
-
+        suggestions = generate_structured_response(prompt, TOPIC_LIST_SCHEMA, "suggest_multiple_topics")
         print("Suggestions received:", suggestions)
-        return suggestions if isinstance(suggestions, list) else []
-    except json.JSONDecodeError:
-        print("Error: Gemini did not return valid JSON for multiple topic suggestions.")
-        print("Raw Response Text:", json_text if 'json_text' in locals() else 'N/A')
-        return []
+        return suggestions
     except Exception as e:
         print(f"Error during multiple topic suggestion: {e}")
-        print("Full Response object (if available):", response if 'response' in locals() else 'N/A')
         return []
 
 
@@ -304,44 +465,14 @@ def expand_or_suggest_topics(initial_topics, num_needed):
     """
 
     try:
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ]
-        response = gemini_model.generate_content(prompt, safety_settings=safety_settings)
-        json_text = ""
-        try:
-             json_text = response.text.strip().replace('```json', '').replace('```', '').strip()
-             expanded_topics = json.loads(json_text)
-        except ValueError:
-            if response.parts:
-                 json_text = response.parts[0].text.strip().replace('```json', '').replace('```', '').strip()
-                 expanded_topics = json.loads(json_text)
-            else:
-                raise ValueError("Gemini response blocked or empty for topic expansion.")
-
-        if isinstance(expanded_topics, list) and len(expanded_topics) == num_needed:
-            print(f"Expanded/Suggested topics: {expanded_topics}")
-            return expanded_topics
-        else:
-            print(f"Warning: Gemini returned an unexpected format or wrong number of topics for expansion. Expected {num_needed}, Got: {expanded_topics}")
-            result = list(initial_topics)
-            while len(result) < num_needed:
-                 result.append(f"{initial_topics[0]} - Aspect {len(result)}")
-            return result[:num_needed]
+        expanded_topics = generate_structured_response(
+            prompt, TOPIC_LIST_SCHEMA, "expand_or_suggest_topics", expected_length=num_needed
+        )
+        print(f"Expanded/Suggested topics: {expanded_topics}")
+        return expanded_topics
 
-    except json.JSONDecodeError:
-        print("Error: Gemini did not return valid JSON for topic expansion.")
-        print("Raw Response Text:", json_text if 'json_text' in locals() else 'N/A')
-        result = list(initial_topics)
-        while len(result) < num_needed:
-             result.append(f"{initial_topics[0]} - Aspect {len(result)}")
-        return result[:num_needed]
     except Exception as e:
         print(f"Error during topic expansion/suggestion: {e}")
-        print("Full Response object (if available):", response if 'response' in locals() else 'N/A')
         result = list(initial_topics)
         while len(result) < num_needed:
              result.append(f"{initial_topics[0]} - Aspect {len(result)}")
@@ -349,9 +480,82 @@ def expand_or_suggest_topics(initial_topics, num_needed):
 
 
 
+def _context_terms(text):
+    """Lowercased word tokens used for TF-IDF scoring, without stopwords."""
+    return [w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in CONTEXT_STOPWORDS]
+
+
+def compress_search_context(topic, results, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Reduces Tavily results to the sentences most relevant to 'topic'.
+    Sentences are deduplicated across results (exact and near-duplicate by
+    TF-IDF cosine similarity), ranked by similarity to the topic, and kept
+    until 'token_budget' is reached. Returns a list of (url, sentence) in
+    their original order.
+    """
+    sentences = []
+    seen = set()
+    for result in results:
+        url = result.get('url', 'N/A')
+        for sentence in re.split(r"(?<=[.!?])\s+", result.get('content') or ""):
+            sentence = " ".join(sentence.split())
+            key = " ".join(_context_terms(sentence))
+            if len(sentence.split()) < CONTEXT_MIN_SENTENCE_WORDS or not key or key in seen:
+                continue
+            seen.add(key)
+            sentences.append((url, sentence))
+
+    if not sentences:
+        return []
+
+    term_lists = [_context_terms(sentence) for _, sentence in sentences]
+    vocab = {}
+    for terms in term_lists:
+        for term in terms:
+            vocab.setdefault(term, len(vocab))
+
+    tf = np.zeros((len(sentences), len(vocab)))
+    for row, terms in enumerate(term_lists):
+        for term in terms:
+            tf[row, vocab[term]] += 1
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + len(sentences)) / (1 + df)) + 1
+    matrix = tf * idf
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    query = np.zeros(len(vocab))
+    for term in _context_terms(topic):
+        if term in vocab:
+            query[vocab[term]] += 1
+    query *= idf
+    relevance = matrix @ query
+    # Favour earlier sentences on ties; search snippets usually lead with the summary
+    order = np.lexsort((np.arange(len(sentences)), -relevance))
+
+    similarity = matrix @ matrix.T
+    kept = []
+    used_tokens = 0
+    for index in order:
+        if kept and similarity[index, kept].max() >= CONTEXT_DUPLICATE_SIMILARITY:
+            continue
+        url, sentence = sentences[index]
+        cost = len(sentence) // 4 + 1
+        if used_tokens + cost > token_budget:
+            if kept:
+                continue
+            # The top-ranked sentence alone exceeds the budget (e.g. a scraped list or table): truncate it
+            sentences[index] = (url, sentence[:max(token_budget - used_tokens - 1, 0) * 4].rstrip() + "...")
+            cost = token_budget - used_tokens
+        kept.append(index)
+        used_tokens += cost
+
+    return [sentences[i] for i in sorted(kept)]
+
+
 def search_web_for_topic(topic):
     """
-    Uses Tavily to search the web for a given topic and returns context.
+    Uses Tavily to search the web for a given topic and returns context,
+    compressed to CONTEXT_TOKEN_BUDGET with compress_search_context().
     """
     print(f"Searching web for: '{topic}'...")
     try:
@@ -363,8 +567,19 @@ def search_web_for_topic(topic):
         )
         context = f"Topic: {topic}\n\nSearch Results Context:\n"
         if response.get('results'):
-             for result in response['results']:
-                 context += f"- Source: {result.get('url', 'N/A')}\n  Snippet: {result.get('content', 'N/A')}\n\n"
+             raw_length = sum(len(result.get('content') or "") for result in response['results'])
+             selected = compress_search_context(topic, response['results'])
+             current_url = None
+             for url, sentence in selected:
+                 if url != current_url:
+                     context += f"\n- Source: {url}\n"
+                     current_url = url
+                 context += f"  {sentence}\n"
+             if not selected:
+                 print(f"Warning: Context compression kept nothing for '{topic}'. Falling back to truncated raw snippets.")
+                 raw_snippets = " ".join(result.get('content') or "" for result in response['results'])
+                 context += f"  {raw_snippets[:CONTEXT_TOKEN_BUDGET * 4]}\n"
+             print(f"Compressed search context for '{topic}': {raw_length} -> {len(context)} chars.")
         else:
              print(f"Warning: No search results found for '{topic}'. Summary might be less informative.")
              context += "No specific search results found."
@@ -401,21 +616,8 @@ def generate_learning_script(topic, context):
     - Output ONLY the script text, ready for text-to-speech conversion. Do not include titles like "Script:" or notes.
     """
     try:
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ]
-        response = gemini_model.generate_content(prompt, safety_settings=safety_settings)
-        script_text = ""
-        try:
-            script_text = response.text.strip()
-        except ValueError:
-            if response.parts:
-                script_text = response.parts[0].text.strip()
-            else:
-                 raise ValueError("Gemini response blocked or empty for script generation.")
+        response = gemini_model.generate_content(prompt, safety_settings=GEMINI_SAFETY_SETTINGS)
+        script_text = get_response_text(response)
 
         if not script_text:
              print(f"Warning: Generated empty script for '{topic}'.")
@@ -430,18 +632,25 @@ def generate_learning_script(topic, context):
 
 
 
-def generate_audio_elevenlabs(script_text, output_filepath):
+def generate_audio_elevenlabs(script_text, output_filepath, profile_name=None, voice_id=None, model_id=None):
     """
     Generates audio from text using ElevenLabs API and saves to a file.
+    'profile_name' selects an entry from AUDIO_PROFILES (defaults to AUDIO_PROFILE).
+    'voice_id' defaults to ELEVENLABS_VOICE_ID; 'model_id' to the ElevenLabs default model.
     Returns True if successful, False otherwise.
     """
     print(f"Generating audio for: {os.path.basename(output_filepath)}...")
     if not script_text or len(script_text.strip()) < 10:
         print("Error: Script text is too short or empty. Skipping TTS.")
         return False
+    profile = AUDIO_PROFILES.get(profile_name or AUDIO_PROFILE, AUDIO_PROFILES["standard"])
+    params = {"output_format": profile["output_format"]}
     data = {"text": script_text, "voice_settings": {"stability": 0.5, "similarity_boost": 0.5}}
+    if model_id:
+        data["model_id"] = model_id
+    api_url = ELEVENLABS_TTS_URL.format(voice_id=voice_id) if voice_id else ELEVENLABS_API_URL
     try:
-        response = requests.post(ELEVENLABS_API_URL, headers=ELEVENLABS_HEADERS, json=data, timeout=180)
+        response = requests.post(api_url, headers=ELEVENLABS_HEADERS, params=params, json=data, timeout=180)
         if response.status_code == 200:
             with open(output_filepath, "wb") as f: f.write(response.content)
             print(f"Audio saved as {output_filepath}")
@@ -455,6 +664,31 @@ def generate_audio_elevenlabs(script_text, output_filepath):
     except Exception as e: print(f"Unexpected error during TTS generation: {e}"); return False
 
 
+def translate_script(script_text, language):
+    """
+    Uses Gemini to translate a finished learning script into 'language',
+    keeping it ready for text-to-speech. Returns the translation or None on failure.
+    """
+    print(f"Translating script to {language}...")
+    prompt = f"""
+    Translate the following audio learning script into {language}.
+    Keep the same tone, structure and length. It will be read aloud by text-to-speech.
+    Output ONLY the translated script text, without titles or notes.
+
+    Script:
+    ---
+    {script_text}
+    ---
+    """
+    try:
+        response = gemini_model.generate_content(prompt, safety_settings=GEMINI_SAFETY_SETTINGS)
+        translated = get_response_text(response)
+        return translated or None
+    except Exception as e:
+        print(f"Error translating script to {language}: {e}")
+        return None
+
+
 def sanitize_filename(name):
     """Removes or replaces characters invalid for filenames."""
     name = re.sub(r'[\\/*?:"<>|]', "", name)
@@ -462,12 +696,206 @@ def sanitize_filename(name):
     return name[:50]
 
 
-def process_single_request(user_prompt, session_history):
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the
+    function, later callers block until it finishes and receive the same result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Returns (result, shared). 'shared' is True if another caller did the work."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+
+        if not leader:
+            print(f"Joining in-flight work for {key}...")
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+
+        try:
+            call["result"] = fn(*args, **kwargs)
+            return call["result"], False
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+
+
+PLAYLIST_FLIGHTS = SingleFlight()
+SEGMENT_FLIGHTS = SingleFlight()
+# How often a process waiting on another process's segment checks the shared store
+SEGMENT_POLL_SECONDS = 1
+
+
+def notify_progress(progress_callback, event, **data):
+    """Passes a pipeline stage event to 'progress_callback'. Callback errors never abort generation."""
+    if progress_callback is None:
+        return
+    try:
+        progress_callback(event, data)
+    except Exception as e:
+        print(f"Error in progress callback for '{event}': {e}")
+
+
+def normalize_request_key(text):
+    """Lowercases, collapses whitespace and drops trailing punctuation so equivalent prompts share a key."""
+    return " ".join(text.lower().split()).strip(" .!?")
+
+
+def render_segment(topic, audio_filepath_absolute, audio_profile, segment_number=None, progress_callback=None):
+    """
+    Searches, scripts and voices a single topic into 'audio_filepath_absolute'.
+    Emits a "segment" progress event after each stage.
+    Returns the script text if audio was saved, otherwise None.
+    """
+    context = search_web_for_topic(topic)
+    notify_progress(progress_callback, "segment", segment_number=segment_number, topic=topic, stage="search", ok=True)
+    time.sleep(1)
+    script = generate_learning_script(topic, context)
+    script_ok = bool(script) and "Error:" not in script
+    notify_progress(progress_callback, "segment", segment_number=segment_number, topic=topic, stage="script", ok=script_ok)
+    if not script_ok:
+        print(f"Skipping audio generation for '{topic}' due to script error.")
+        return None
+
+    time.sleep(1)
+    audio_ok = generate_audio_elevenlabs(script, audio_filepath_absolute, audio_profile)
+    notify_progress(progress_callback, "segment", segment_number=segment_number, topic=topic, stage="audio", ok=audio_ok)
+    return script if audio_ok else None
+
+
+def render_segment_shared(topic, audio_filepath_absolute, audio_profile, segment_number=None, progress_callback=None):
+    """
+    render_segment() with single-flight coalescing across processes via shared_state.
+    If another process is already rendering the same (topic, audio_profile), polls
+    until it finishes instead of calling the APIs again.
+    Returns (script, audio path holding the result, shared).
+    """
+    segment_key = json.dumps(["segment", normalize_request_key(topic), audio_profile])
+    while True:
+        try:
+            flight_id, leader = shared_state.claim_segment(uuid.uuid4().hex, segment_key, audio_filepath_absolute)
+        except Exception as e:
+            print(f"Error claiming shared segment '{topic}', rendering without coalescing: {e}")
+            script = render_segment(topic, audio_filepath_absolute, audio_profile, segment_number, progress_callback)
+            return script, audio_filepath_absolute, False
+        if leader:
+            break
+
+        print(f"Waiting for another worker rendering '{topic}'...")
+        segment = shared_state.get_segment(flight_id)
+        while segment is not None and segment["status"] == "running":
+            time.sleep(SEGMENT_POLL_SECONDS)
+            segment = shared_state.get_segment(flight_id)
+        if segment is not None and segment["status"] in ("done", "failed"):
+            return segment["script"], segment["audio_path"], True
+        # Leader died or its record was pruned: try to take over
+        print(f"Shared render of '{topic}' was abandoned, claiming it again.")
+
+    stop_heartbeat = threading.Event()
+
+    def keep_segment_alive():
+        while not stop_heartbeat.wait(shared_state.JOB_HEARTBEAT_SECONDS):
+            try:
+                shared_state.heartbeat_segment(flight_id)
+            except Exception as e:
+                print(f"Error updating heartbeat for segment '{topic}': {e}")
+
+    threading.Thread(target=keep_segment_alive, daemon=True).start()
+    script = None
+    try:
+        script = render_segment(topic, audio_filepath_absolute, audio_profile, segment_number, progress_callback)
+        return script, audio_filepath_absolute, False
+    finally:
+        stop_heartbeat.set()
+        try:
+            shared_state.finish_segment(flight_id, script)
+        except Exception as e:
+            print(f"Error recording shared segment '{topic}': {e}")
+
+
+def render_segment_coalesced(topic, audio_filepath_absolute, audio_profile, segment_number=None, progress_callback=None):
+    """
+    render_segment() with single-flight coalescing on (topic, audio_profile).
+    If an identical segment is already being rendered for another playlist, in
+    this process or (via render_segment_shared) in another one, waits for it and
+    copies its audio file instead of calling the APIs again.
+    """
+    key = ("segment", normalize_request_key(topic), audio_profile)
+    (script, source_path, shared_across_processes), shared = SEGMENT_FLIGHTS.do(
+        key, render_segment_shared, topic, audio_filepath_absolute, audio_profile, segment_number, progress_callback
+    )
+    shared = shared or shared_across_processes
+    if shared and script and source_path != audio_filepath_absolute:
+        try:
+            shutil.copyfile(source_path, audio_filepath_absolute)
+            print(f"Reused in-flight audio for '{topic}' from {source_path}")
+        except OSError as e:
+            print(f"Error copying shared audio for '{topic}': {e}")
+            script = None
+    if shared:
+        notify_progress(progress_callback, "segment", segment_number=segment_number, topic=topic, stage="audio", ok=bool(script), shared=True)
+    return script
+
+
+def update_json_locked(filepath, update_fn):
+    """
+    Read-modify-writes a JSON file while holding an exclusive lock on
+    '<filepath>.lock'. 'update_fn' receives the current data (None if the file
+    doesn't exist) and returns the data to write. The write is atomic.
+    """
+    with open(filepath + ".lock", "w") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        current = None
+        if os.path.exists(filepath):
+            with open(filepath, "r", encoding='utf-8') as f:
+                current = json.load(f)
+        data = update_fn(current)
+        temp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_filepath, "w", encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(temp_filepath, filepath)
+    return data
+
+
+def process_single_request(user_prompt, session_history, audio_profile=None, progress_callback=None):
     """
     Processes a single user request: analyzes, determines topics,
     generates scripts & audio, saves files.
+    'audio_profile' picks the TTS output tier from AUDIO_PROFILES (defaults to AUDIO_PROFILE).
+    Concurrent requests with an equivalent prompt and profile are coalesced onto
+    one run; the result then carries "shared": True for the callers that joined it.
+    'progress_callback(event, data)', if given, is called as the pipeline reaches
+    each stage ("analysis", "topics", "segment").
     Returns a dictionary with result info (folder path, topics, title) or None on failure.
     """
+    if audio_profile not in AUDIO_PROFILES:
+        audio_profile = AUDIO_PROFILE
+    key = ("playlist", normalize_request_key(user_prompt), audio_profile)
+    result, shared = PLAYLIST_FLIGHTS.do(
+        key, _process_single_request, user_prompt, session_history, audio_profile, progress_callback
+    )
+    if result is None:
+        return None
+    return dict(result, shared=shared)
+
+
+def _process_single_request(user_prompt, session_history, audio_profile, progress_callback):
+    """Uncoalesced body of process_single_request()."""
     print(f"\n>>> Processing request: '{user_prompt}' <<<")
     print(f"    Current history: {session_history}")
 
@@ -481,6 +909,7 @@ def process_single_request(user_prompt, session_history):
     requested_topics = analysis.get("requested_topics", [])
     requires_suggestion = analysis.get("requires_suggestion", False)
     segments_based_on_time = analysis.get("segments_based_on_time", False)
+    notify_progress(progress_callback, "analysis", segments_needed=segments_needed, requested_topics=requested_topics)
 
     if segments_needed == 0:
          print("Could not determine number of segments needed.")
@@ -520,17 +949,20 @@ def process_single_request(user_prompt, session_history):
     folder_name_base = sanitize_filename(final_topics[0]) if final_topics else "general"
 
     base_output_dir = "generated_playlists"
-    output_folder_name = f"playlist_{playlist_timestamp}_{folder_name_base}"
+    # Random suffix keeps folders unique when several workers start the same topic in the same second
+    output_folder_name = f"playlist_{playlist_timestamp}_{uuid.uuid4().hex[:8]}_{folder_name_base}"
     output_folder_path = os.path.join(base_output_dir, output_folder_name)
     try:
         os.makedirs(output_folder_path, exist_ok=True)
         print(f"\n Saving audio files to folder: {output_folder_path}")
+        notify_progress(progress_callback, "playlist_folder", folder_name=output_folder_name)
     except OSError as e:
         print(f" Error creating output folder '{output_folder_path}': {e}")
         return None # Indicate failure
 
 
     print(f"\nGenerating playlist for topics: {final_topics}")
+    notify_progress(progress_callback, "topics", topics=final_topics)
     playlist_segments_data = []
     successfully_generated_topics_this_run = [] 
 
@@ -540,28 +972,29 @@ def process_single_request(user_prompt, session_history):
              continue
 
         print(f"\n--- Processing Segment {i+1}/{len(final_topics)}: {topic} ---")
-        context = search_web_for_topic(topic)
-        time.sleep(1)
-        script = generate_learning_script(topic, context)
-
-        audio_success = False
-        audio_filepath_relative = None 
-        if script and "Error:" not in script:
-            safe_topic_name = sanitize_filename(topic)
-            audio_filename = f"segment_{i+1}_{safe_topic_name}.mp3"
-            audio_filepath_absolute = os.path.join(output_folder_path, audio_filename)
-            audio_filepath_relative = os.path.join(output_folder_name, audio_filename) 
-
-            time.sleep(1)
-            audio_success = generate_audio_elevenlabs(script, audio_filepath_absolute)
-        else:
-            print(f"Skipping audio generation for '{topic}' due to script error.")
+        safe_topic_name = sanitize_filename(topic)
+        audio_filename = f"segment_{i+1}_{safe_topic_name}.{AUDIO_PROFILES[audio_profile]['extension']}"
+        audio_filepath_absolute = os.path.join(output_folder_path, audio_filename)
+        audio_filepath_relative = os.path.join(output_folder_name, audio_filename) 
+
+        script = render_segment_coalesced(topic, audio_filepath_absolute, audio_profile, i + 1, progress_callback)
+
+        if script:
+             # Keep the full script so the segment can be re-rendered (other voices/languages) later
+             script_filename = f"segment_{i+1}_{safe_topic_name}.txt"
+             script_filepath_relative = None
+             try:
+                 with open(os.path.join(output_folder_path, script_filename), "w", encoding='utf-8') as f:
+                     f.write(script)
+                 script_filepath_relative = os.path.join(output_folder_name, script_filename)
+             except OSError as e:
+                 print(f"Error saving script for '{topic}': {e}")
 
-        if audio_success and audio_filepath_relative:
              playlist_segments_data.append({
                  "segment_number": i + 1,
                  "topic": topic,
                  "script_preview": script[:100] + "...",
+                 "script_file": script_filepath_relative,
                  "audio_file": audio_filepath_relative
              })
              successfully_generated_topics_this_run.append(topic)
@@ -591,14 +1024,15 @@ def process_single_request(user_prompt, session_history):
         "output_folder_name": output_folder_name, 
         "output_folder_path": output_folder_path, 
         "total_segments": len(playlist_segments_data),
+        "audio_profile": audio_profile,
+        "audio_format": AUDIO_PROFILES[audio_profile]["output_format"],
         "segments": playlist_segments_data
     }
 
    
     try:
         summary_filepath = os.path.join(output_folder_path, "playlist_summary.json")
-        with open(summary_filepath, "w", encoding='utf-8') as f:
-             json.dump(output_summary_data, f, indent=2, ensure_ascii=False)
+        update_json_locked(summary_filepath, lambda _: output_summary_data)
         print(f"\nPlaylist summary saved to {summary_filepath}")
     except Exception as e:
         print(f"\nError saving playlist summary file: {e}")
@@ -614,6 +1048,116 @@ def process_single_request(user_prompt, session_history):
     }
 
 
+def rerender_playlist(folder_path, voice_ids=None, languages=None, audio_profile=None, progress_callback=None):
+    """
+    Renders an existing playlist's saved scripts into additional voices and/or
+    languages, skipping search and script generation. Every combination of
+    'voice_ids' (default: ELEVENLABS_VOICE_ID) and 'languages' (None = original
+    language) becomes a variant under '<folder>/variants/'. Translations run once
+    per language. Translation and TTS calls run on RERENDER_EXECUTOR, which is
+    shared by all re-renders in the process, so at most RERENDER_MAX_WORKERS
+    calls are in flight per process.
+    Variants are recorded in playlist_summary.json under "variants".
+    Returns the list of variant dicts written, or None if the playlist has no saved scripts.
+    """
+    if audio_profile not in AUDIO_PROFILES:
+        audio_profile = AUDIO_PROFILE
+    voice_ids = voice_ids or [ELEVENLABS_VOICE_ID]
+    languages = languages or [None]
+    base_output_dir = os.path.dirname(os.path.abspath(folder_path))
+    folder_name = os.path.basename(os.path.abspath(folder_path))
+    summary_filepath = os.path.join(folder_path, "playlist_summary.json")
+
+    try:
+        with open(summary_filepath, "r", encoding='utf-8') as f:
+            summary = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error reading playlist summary {summary_filepath}: {e}")
+        return None
+
+    scripts = {}
+    for segment in summary.get("segments", []):
+        if not segment.get("script_file"):
+            continue
+        try:
+            with open(os.path.join(base_output_dir, segment["script_file"]), "r", encoding='utf-8') as f:
+                scripts[segment["segment_number"]] = (segment, f.read())
+        except OSError as e:
+            print(f"Error reading script for segment {segment['segment_number']}: {e}")
+    if not scripts:
+        print(f"No saved scripts in '{folder_name}'; it was generated before scripts were persisted.")
+        return None
+
+    print(f"\n>>> Re-rendering '{folder_name}' for voices {voice_ids} and languages {languages} <<<")
+    # Translate each (language, segment) once, shared by all voices
+    translation_jobs = {
+        (language, number): RERENDER_EXECUTOR.submit(translate_script, script, language)
+        for language in languages if language
+        for number, (_, script) in scripts.items()
+    }
+    texts = {(None, number): script for number, (_, script) in scripts.items()}
+    texts.update({key: future.result() for key, future in translation_jobs.items()})
+
+    tts_jobs = {}
+    for language in languages:
+        for voice_id in voice_ids:
+            variant_dir_name = f"{sanitize_filename(language or 'original')}_{sanitize_filename(voice_id)}_{audio_profile}"
+            variant_dir = os.path.join(folder_path, "variants", variant_dir_name)
+            os.makedirs(variant_dir, exist_ok=True)
+            for number, (segment, _) in scripts.items():
+                text = texts.get((language, number))
+                if not text:
+                    continue
+                stem = os.path.splitext(os.path.basename(segment["audio_file"]))[0]
+                audio_filename = f"{stem}.{AUDIO_PROFILES[audio_profile]['extension']}"
+                script_filename = f"{stem}.txt"
+                with open(os.path.join(variant_dir, script_filename), "w", encoding='utf-8') as f:
+                    f.write(text)
+                future = RERENDER_EXECUTOR.submit(
+                    generate_audio_elevenlabs, text, os.path.join(variant_dir, audio_filename),
+                    audio_profile, voice_id, ELEVENLABS_MULTILINGUAL_MODEL_ID if language else None
+                )
+                relative_dir = os.path.join(folder_name, "variants", variant_dir_name)
+                tts_jobs[(language, voice_id, number)] = (future, segment, relative_dir, audio_filename, script_filename)
+
+    variants = {}
+    for (language, voice_id, number), (future, segment, relative_dir, audio_filename, script_filename) in tts_jobs.items():
+        ok = future.result()
+        notify_progress(progress_callback, "rerender", folder_name=folder_name, voice_id=voice_id,
+                        language=language, segment_number=number, topic=segment["topic"], ok=ok)
+        variant = variants.setdefault((language, voice_id), {
+            "voice_id": voice_id,
+            "language": language,
+            "audio_profile": audio_profile,
+            "segments": [],
+        })
+        if ok:
+            variant["segments"].append({
+                "segment_number": number,
+                "topic": segment["topic"],
+                "script_file": os.path.join(relative_dir, script_filename),
+                "audio_file": os.path.join(relative_dir, audio_filename),
+            })
+
+    new_variants = [v for v in variants.values() if v["segments"]]
+    for variant in new_variants:
+        variant["segments"].sort(key=lambda seg: seg["segment_number"])
+
+    def merge_variants(current):
+        current = current or summary
+        same = lambda a, b: all(a.get(k) == b.get(k) for k in ("voice_id", "language", "audio_profile"))
+        kept = [v for v in current.get("variants", []) if not any(same(v, n) for n in new_variants)]
+        current["variants"] = kept + new_variants
+        return current
+
+    try:
+        update_json_locked(summary_filepath, merge_variants)
+    except Exception as e:
+        print(f"Error updating playlist summary with variants: {e}")
+    print(f">>> Re-render finished for '{folder_name}': {len(new_variants)} variant(s) <<<")
+    return new_variants
+
+
 if __name__ == '__main__':
     print("Running model_wt_audio.py standalone for testing...")
     test_history = []
@@ -0,0 +1,432 @@
+import os
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+
+
+# SQLite file shared by every web worker and generation worker on this machine.
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "app_state.sqlite3")
+# Running jobs refresh heartbeat_at this often; a job silent for the timeout is
+# treated as abandoned (its worker crashed or was killed) and marked failed.
+JOB_HEARTBEAT_SECONDS = 30
+JOB_HEARTBEAT_TIMEOUT_SECONDS = 4 * JOB_HEARTBEAT_SECONDS
+JOB_ABANDONED_MESSAGE = "Generation stopped unexpectedly (worker lost). Please try again."
+# Progress events are only needed while clients are watching; older rows are pruned.
+EVENT_RETENTION_SECONDS = 10 * 60
+
+
+@contextmanager
+def _connect():
+    """Short-lived autocommit connection; multi-statement updates use explicit BEGIN IMMEDIATE."""
+    conn = sqlite3.connect(STATE_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def init_db():
+    """Creates the shared state tables if they don't exist yet."""
+    with _connect() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS playlists (
+                name TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS last_played (
+                name TEXT PRIMARY KEY,
+                played_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS session_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                request_key TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                audio_profile TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                heartbeat_at REAL,
+                kind TEXT NOT NULL DEFAULT 'generate',
+                payload TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+            CREATE TABLE IF NOT EXISTS job_folders (
+                job_id TEXT NOT NULL,
+                folder_name TEXT NOT NULL,
+                PRIMARY KEY (job_id, folder_name)
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                event TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS events_job ON events (job_id, id);
+            CREATE TABLE IF NOT EXISTS segment_flights (
+                flight_id TEXT PRIMARY KEY,
+                segment_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                audio_path TEXT NOT NULL,
+                script TEXT,
+                created_at REAL NOT NULL,
+                heartbeat_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS segment_flights_key ON segment_flights (segment_key, status);
+            CREATE TABLE IF NOT EXISTS parse_metrics (
+                call_name TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (call_name, outcome)
+            );
+        """)
+        _ensure_column(conn, "jobs", "heartbeat_at", "REAL")
+        _ensure_column(conn, "jobs", "kind", "TEXT NOT NULL DEFAULT 'generate'")
+        _ensure_column(conn, "jobs", "payload", "TEXT")
+
+
+def _ensure_column(conn, table, column, declaration):
+    """Adds a column missing from a state DB created by an older version."""
+    columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column in columns:
+        return
+    try:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    except sqlite3.OperationalError:
+        # Another process added it first
+        pass
+
+
+def get_or_create_secret_key():
+    """Returns a Flask secret key shared by all web workers, generating it on first use."""
+    with _connect() as conn:
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('secret_key', ?)", (os.urandom(24).hex(),))
+        return bytes.fromhex(conn.execute("SELECT value FROM meta WHERE key = 'secret_key'").fetchone()["value"])
+
+
+# --- Playlists ---
+
+def add_playlist(name, title):
+    """Adds a playlist to the catalog. Returns False if it was already listed."""
+    with _connect() as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO playlists (name, title, created_at) VALUES (?, ?, ?)",
+            (name, title, time.time())
+        )
+        return cursor.rowcount == 1
+
+
+def list_playlists():
+    """Returns [{'name', 'title'}], newest first."""
+    with _connect() as conn:
+        rows = conn.execute("SELECT name, title FROM playlists ORDER BY created_at DESC").fetchall()
+    return [dict(row) for row in rows]
+
+
+def get_playlist_names():
+    with _connect() as conn:
+        rows = conn.execute("SELECT name FROM playlists").fetchall()
+    return {row["name"] for row in rows}
+
+
+def forget_playlist(name):
+    """Removes a playlist from the catalog and from play tracking."""
+    with _connect() as conn:
+        conn.execute("DELETE FROM playlists WHERE name = ?", (name,))
+        conn.execute("DELETE FROM last_played WHERE name = ?", (name,))
+
+
+def mark_played(name):
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO last_played (name, played_at) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET played_at = excluded.played_at",
+            (name, time.time())
+        )
+
+
+def get_last_played():
+    """Returns {'folder_name': last_played_unix_time}."""
+    with _connect() as conn:
+        rows = conn.execute("SELECT name, played_at FROM last_played").fetchall()
+    return {row["name"]: row["played_at"] for row in rows}
+
+
+# --- Session history ---
+
+def get_session_history():
+    with _connect() as conn:
+        rows = conn.execute("SELECT topic FROM session_history ORDER BY id").fetchall()
+    return [row["topic"] for row in rows]
+
+
+def extend_session_history(topics):
+    with _connect() as conn:
+        conn.executemany("INSERT INTO session_history (topic) VALUES (?)", [(topic,) for topic in topics])
+
+
+# --- Generation jobs ---
+
+def _reap_stale_jobs(conn):
+    """
+    Marks running jobs whose heartbeat stopped as failed and records a
+    'finished' event for them, so clients following the job stop waiting.
+    Must be called inside a write transaction. Returns the reaped job ids.
+    """
+    now = time.time()
+    rows = conn.execute(
+        "SELECT job_id FROM jobs WHERE status = 'running' AND COALESCE(heartbeat_at, created_at) < ?",
+        (now - JOB_HEARTBEAT_TIMEOUT_SECONDS,)
+    ).fetchall()
+    for row in rows:
+        conn.execute("UPDATE jobs SET status = 'failed' WHERE job_id = ?", (row["job_id"],))
+        conn.execute(
+            "INSERT INTO events (job_id, event, data, created_at) VALUES (?, 'finished', ?, ?)",
+            (row["job_id"], json.dumps({"job_id": row["job_id"], "messages": [[JOB_ABANDONED_MESSAGE, "error"]]}), now)
+        )
+    return [row["job_id"] for row in rows]
+
+
+def reap_stale_jobs():
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            reaped = _reap_stale_jobs(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    if reaped:
+        print(f"Marked abandoned jobs as failed: {reaped}")
+    return reaped
+
+
+def enqueue_job(job_id, request_key, prompt, audio_profile, kind="generate", payload=None):
+    """
+    Queues a job ('generate', or 'rerender' with its parameters in 'payload').
+    If an equivalent job (same request_key) is already queued or running, no new
+    job is created and that job's id is returned instead.
+    Returns (job_id, created).
+    """
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _reap_stale_jobs(conn)
+            existing = conn.execute(
+                "SELECT job_id FROM jobs WHERE request_key = ? AND status IN ('queued', 'running')",
+                (request_key,)
+            ).fetchone()
+            if existing:
+                conn.execute("COMMIT")
+                return existing["job_id"], False
+            conn.execute(
+                "INSERT INTO jobs (job_id, request_key, prompt, audio_profile, status, created_at, kind, payload) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, request_key, prompt, audio_profile, time.time(), kind,
+                 json.dumps(payload) if payload is not None else None)
+            )
+            conn.execute("COMMIT")
+            return job_id, True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def claim_job():
+    """
+    Atomically marks the oldest queued job as running and returns it, or None.
+    Abandoned running jobs are failed first (see _reap_stale_jobs).
+    """
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _reap_stale_jobs(conn)
+            row = conn.execute(
+                "SELECT job_id, prompt, audio_profile, kind, payload FROM jobs "
+                "WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', heartbeat_at = ? WHERE job_id = ?", (time.time(), row["job_id"])
+                )
+            conn.execute("COMMIT")
+            if row is None:
+                return None
+            job = dict(row)
+            job["payload"] = json.loads(job["payload"]) if job["payload"] else None
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def start_job(job_id):
+    """Marks a job as running without going through claim_job() (inline mode)."""
+    with _connect() as conn:
+        conn.execute("UPDATE jobs SET status = 'running', heartbeat_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+
+def heartbeat_job(job_id):
+    with _connect() as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND status = 'running'", (time.time(), job_id))
+
+
+def add_job_folder(job_id, folder_name):
+    """Records that a job is writing into a playlist folder, so it isn't evicted meanwhile."""
+    with _connect() as conn:
+        conn.execute("INSERT OR IGNORE INTO job_folders (job_id, folder_name) VALUES (?, ?)", (job_id, folder_name))
+
+
+def get_busy_folders():
+    """Returns the set of playlist folders that queued or running jobs are using."""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT DISTINCT f.folder_name FROM job_folders f JOIN jobs j ON j.job_id = f.job_id "
+            "WHERE j.status IN ('queued', 'running')"
+        ).fetchall()
+    return {row["folder_name"] for row in rows}
+
+
+def finish_job(job_id, status):
+    with _connect() as conn:
+        conn.execute("UPDATE jobs SET status = ? WHERE job_id = ?", (status, job_id))
+
+
+# --- Segment single-flight across processes ---
+
+def claim_segment(flight_id, segment_key, audio_path):
+    """
+    Registers 'flight_id' as the renderer of 'segment_key' (normalized topic and
+    audio profile) unless another process is already rendering it.
+    Returns (flight_id, leader): the new flight and True, or the in-flight one and False.
+    """
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = conn.execute(
+                "SELECT flight_id FROM segment_flights "
+                "WHERE segment_key = ? AND status = 'running' AND heartbeat_at >= ?",
+                (segment_key, time.time() - JOB_HEARTBEAT_TIMEOUT_SECONDS)
+            ).fetchone()
+            if existing:
+                conn.execute("COMMIT")
+                return existing["flight_id"], False
+            now = time.time()
+            conn.execute(
+                "INSERT INTO segment_flights (flight_id, segment_key, status, audio_path, created_at, heartbeat_at) "
+                "VALUES (?, ?, 'running', ?, ?, ?)",
+                (flight_id, segment_key, audio_path, now, now)
+            )
+            conn.execute("COMMIT")
+            return flight_id, True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def heartbeat_segment(flight_id):
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE segment_flights SET heartbeat_at = ? WHERE flight_id = ? AND status = 'running'",
+            (time.time(), flight_id)
+        )
+
+
+def finish_segment(flight_id, script):
+    """Records the leader's result; a None script marks the segment as failed."""
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE segment_flights SET status = ?, script = ? WHERE flight_id = ?",
+            ("done" if script else "failed", script, flight_id)
+        )
+
+
+def get_segment(flight_id):
+    """
+    Returns {'status', 'audio_path', 'script'} for a flight, or None if it was pruned.
+    A running flight whose leader stopped heartbeating is reported as 'abandoned'.
+    """
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT status, audio_path, script, heartbeat_at FROM segment_flights WHERE flight_id = ?", (flight_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    segment = dict(row)
+    if segment.pop("heartbeat_at") < time.time() - JOB_HEARTBEAT_TIMEOUT_SECONDS and segment["status"] == "running":
+        segment["status"] = "abandoned"
+    return segment
+
+
+# --- Structured-output parse metrics ---
+
+def increment_parse_metric(call_name, outcome):
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO parse_metrics (call_name, outcome, count) VALUES (?, ?, 1) "
+            "ON CONFLICT(call_name, outcome) DO UPDATE SET count = count + 1",
+            (call_name, outcome)
+        )
+
+
+def get_parse_metrics():
+    """Returns [(call_name, outcome, count)]."""
+    with _connect() as conn:
+        rows = conn.execute("SELECT call_name, outcome, count FROM parse_metrics").fetchall()
+    return [(row["call_name"], row["outcome"], row["count"]) for row in rows]
+
+
+# --- Progress events ---
+
+def add_event(job_id, event, data):
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, event, json.dumps(data), time.time())
+        )
+
+
+def get_last_event_id():
+    with _connect() as conn:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) AS last_id FROM events").fetchone()["last_id"]
+
+
+def get_events_after(last_id, limit=500):
+    """Returns [(id, event, data)] for events newer than last_id, oldest first."""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT id, event, data FROM events WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit)
+        ).fetchall()
+    return [(row["id"], row["event"], json.loads(row["data"])) for row in rows]
+
+
+def get_job_events(job_id):
+    """Returns [(id, event, data)] already recorded for one job, oldest first."""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT id, event, data FROM events WHERE job_id = ? ORDER BY id", (job_id,)
+        ).fetchall()
+    return [(row["id"], row["event"], json.loads(row["data"])) for row in rows]
+
+
+def prune_events():
+    with _connect() as conn:
+        conn.execute("DELETE FROM events WHERE created_at < ?", (time.time() - EVENT_RETENTION_SECONDS,))
+        conn.execute(
+            "DELETE FROM segment_flights WHERE heartbeat_at < ?", (time.time() - EVENT_RETENTION_SECONDS,)
+        )
+        conn.execute(
+            "DELETE FROM job_folders WHERE job_id NOT IN "
+            "(SELECT job_id FROM jobs WHERE status IN ('queued', 'running'))"
+        )
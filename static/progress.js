@@ -0,0 +1,117 @@
+// Submits prompts to /generate and renders live pipeline progress from the /events SSE feed.
+// Re-render jobs started via POST /rerender can be followed with window.followJob(jobId).
+// Without JavaScript the form falls back to the regular POST-and-redirect flow.
+(function () {
+  const form = document.getElementById('generate-form');
+  if (!form || !window.EventSource || !window.fetch) {
+    return;
+  }
+
+  const progressLog = document.getElementById('progress-log');
+  const playlistList = document.getElementById('playlist-list');
+  const PROGRESS_EVENTS = ['analysis', 'topics', 'segment', 'rerender'];
+  const TERMINAL_EVENTS = ['playlist_ready', 'finished', 'rerender_finished'];
+
+  function logLine(text, category) {
+    const item = document.createElement('li');
+    item.className = 'flash-message flash-' + (category || 'info');
+    item.textContent = text;
+    progressLog.appendChild(item);
+  }
+
+  function describe(event, data) {
+    switch (event) {
+      case 'analysis':
+        return 'Prompt analysed: ' + data.segments_needed + ' segment(s) needed.';
+      case 'topics':
+        return 'Topics: ' + data.topics.join(', ');
+      case 'segment':
+        return 'Segment ' + data.segment_number + ' (' + data.topic + '): ' + data.stage +
+          (data.ok ? (data.shared ? ' reused' : ' ready') : ' failed');
+      case 'rerender':
+        return 'Re-render ' + data.folder_name + ', segment ' + data.segment_number + ' (' + data.topic + ', ' +
+          (data.language || 'original language') + ', voice ' + data.voice_id + '): ' + (data.ok ? 'ready' : 'failed');
+      default:
+        return null;
+    }
+  }
+
+  function describeRerenderResults(results) {
+    return Object.keys(results).map(function (folderName) {
+      const count = results[folderName];
+      return [
+        folderName + ': ' + (count === null ? 're-render failed' : count + ' variant(s) rendered'),
+        count ? 'success' : 'error'
+      ];
+    });
+  }
+
+  function addPlaylist(folderName) {
+    if (document.querySelector('[data-folder="' + CSS.escape(folderName) + '"]')) {
+      return;
+    }
+    const placeholder = document.getElementById('no-playlists');
+    if (placeholder) {
+      placeholder.remove();
+    }
+    const item = document.createElement('li');
+    item.className = 'folder-item';
+    item.dataset.folder = folderName;
+    const link = document.createElement('a');
+    link.className = 'folder-link';
+    link.href = form.dataset.viewUrl.replace('__folder__', encodeURIComponent(folderName));
+    link.textContent = folderName;
+    item.appendChild(link);
+    playlistList.insertBefore(item, playlistList.firstChild);
+  }
+
+  // Follows one job's stream. The server replays events recorded before we
+  // connected, so nothing is lost while /generate was still returning.
+  function followJob(jobId) {
+    const source = new EventSource(form.dataset.eventsUrl + '?job_id=' + encodeURIComponent(jobId));
+    PROGRESS_EVENTS.forEach(function (event) {
+      source.addEventListener(event, function (e) {
+        const data = JSON.parse(e.data);
+        logLine(describe(event, data), data.ok === false ? 'error' : 'info');
+      });
+    });
+    // A refused stream (e.g. 503 when all stream slots are busy) is not retried
+    // by EventSource, so tell the user instead of waiting silently.
+    source.onerror = function () {
+      if (source.readyState === EventSource.CLOSED) {
+        logLine('Live progress is unavailable. The job keeps running; reload the page later to see the playlist.', 'error');
+      }
+    };
+    TERMINAL_EVENTS.forEach(function (event) {
+      source.addEventListener(event, function (e) {
+        const data = JSON.parse(e.data);
+        source.close();
+        if (data.folder_name) {
+          addPlaylist(data.folder_name);
+        }
+        const messages = event === 'rerender_finished'
+          ? describeRerenderResults(data.variants_per_playlist)
+          : data.messages;
+        messages.forEach(function (m) { logLine(m[0], m[1]); });
+      });
+    });
+  }
+
+  window.followJob = followJob;
+
+  form.addEventListener('submit', function (e) {
+    e.preventDefault();
+    progressLog.innerHTML = '';
+    fetch(form.dataset.generateUrl, { method: 'POST', body: new FormData(form) })
+      .then(function (response) { return response.json(); })
+      .then(function (data) {
+        if (data.job_id) {
+          logLine('Generation started...', 'info');
+          followJob(data.job_id);
+        } else {
+          logLine(data.error || 'Could not start generation.', 'error');
+        }
+      })
+      .catch(function (err) { logLine('Could not start generation: ' + err, 'error'); });
+  });
+})();
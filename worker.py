@@ -0,0 +1,50 @@
+import os
+import time
+import multiprocessing
+
+
+# Generation is dominated by API latency, so the pool defaults to one process per core.
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", multiprocessing.cpu_count()))
+JOB_POLL_SECONDS = 1
+
+
+def worker_loop(worker_number):
+    """Claims queued generation and re-render jobs from the shared store and runs them until interrupted."""
+    # Imported in the child so each process builds its own API clients and DB connections
+    import shared_state
+    from app import run_job
+
+    print(f"Generation worker {worker_number} started (pid {os.getpid()}).")
+    while True:
+        try:
+            job = shared_state.claim_job()
+        except Exception as e:
+            print(f"Worker {worker_number}: error claiming job: {e}")
+            job = None
+
+        if job is None:
+            time.sleep(JOB_POLL_SECONDS)
+            continue
+
+        print(f"Worker {worker_number}: running {job['kind']} job {job['job_id']} ('{job['prompt']}')")
+        try:
+            run_job(job)
+        except Exception as e:
+            print(f"Worker {worker_number}: job {job['job_id']} failed: {e}")
+
+
+if __name__ == '__main__':
+    print(f"Starting {GENERATION_WORKERS} generation worker(s)...")
+    processes = [
+        multiprocessing.Process(target=worker_loop, args=(n + 1,), daemon=True)
+        for n in range(GENERATION_WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("Stopping generation workers...")
+        for process in processes:
+            process.terminate()